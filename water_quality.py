@@ -3,11 +3,148 @@ Water Quality Analysis Module
 Functions for analyzing water quality parameters
 """
 
+import math
+import threading
+from collections import namedtuple
+
 import numpy as np
-import matplotlib.pyplot as plt
 
 
-def analyze_ph(samples=100, mean_ph=7.0, std_dev=0.5):
+# WQI class boundaries; a reading above a threshold moves up one class
+_THRESH = np.array([40.0, 60.0, 80.0])
+# Quality classes and report symbols in order of class code (0-3)
+_STATUS = ("Poor", "Fair", "Good", "Excellent")
+_EMOJI = ("✗", "⚠", "✓", "🌟")
+
+
+def _wqi(turbidity, dissolved_oxygen):
+    """Water Quality Index formula (DO weight 60%, turbidity weight 40%)"""
+    return (dissolved_oxygen * 0.6 + (10.0 - turbidity) * 0.4) * 10.0
+
+
+def _wqi_class(wqi):
+    """Class code (0-3) for a WQI value or array; missing (NaN) readings are Poor"""
+    return np.where(np.isnan(wqi), 0, np.searchsorted(_THRESH, wqi))
+
+
+def _lazy_kernel(compile_kernel, fallback):
+    """
+    Wrap a kernel that is compiled with numba on its first call
+
+    numba takes longer to import than the rest of this module, so it is only
+    loaded once a kernel is actually needed. Without numba the NumPy
+    fallback is used instead.
+    """
+    kernel = None
+
+    def call(*args):
+        nonlocal kernel
+        if kernel is None:
+            try:
+                import numba
+            except ImportError:  # numba is optional; plain NumPy is used without it
+                kernel = fallback
+            else:
+                kernel = compile_kernel(numba)
+        return kernel(*args)
+
+    return call
+
+
+def _summary_loop(a):
+    """
+    Mean, standard deviation, minimum and maximum in a single pass
+
+    Uses Welford's online update for the variance, which stays accurate
+    where the naive sum / sum-of-squares formula loses precision.
+    """
+    mean = 0.0
+    m2 = 0.0
+    lo = a[0]
+    hi = a[0]
+    for i in range(len(a)):
+        x = a[i]
+        delta = x - mean
+        mean += delta / (i + 1)
+        m2 += delta * (x - mean)
+        if x < lo:
+            lo = x
+        if x > hi:
+            hi = x
+    return mean, math.sqrt(m2 / len(a)), lo, hi
+
+
+def _summary_numpy(a):
+    """NumPy fallback for _summary when numba is not installed"""
+    return a.mean(), a.std(), a.min(), a.max()
+
+
+# No fastmath: reassociating the Welford update would undo its accuracy
+_summary = _lazy_kernel(
+    lambda numba: numba.njit(cache=True)(_summary_loop),
+    _summary_numpy,
+)
+
+
+# Report templates, filled with a single %-format and printed in one call
+_RULE = "=" * 50
+_PH_REPORT = "\n".join([
+    _RULE,
+    "pH ANALYSIS RESULTS",
+    _RULE,
+    "Number of samples: %d",
+    "Average pH: %.2f",
+    "Standard deviation: %.2f",
+    "pH Range: %.2f - %.2f",
+    "%.1f%% of samples within safe range",
+    "%s",
+])
+_WQI_REPORT = "\n".join([
+    _RULE,
+    "WATER QUALITY INDEX",
+    _RULE,
+    "Turbidity: %.1f NTU",
+    "Dissolved Oxygen: %.1f mg/L",
+    "Temperature: %.1f°C",
+    "",
+    "Water Quality Index: %.1f/100",
+    "Status: %s %s",
+    _RULE,
+])
+
+# Below this many values a plain Python loop is cheaper than a NumPy/numba call
+_SMALL_SAMPLE = 64
+
+
+def _describe(values):
+    """Mean, standard deviation, minimum and maximum of any array-like"""
+    a = np.asarray(values, dtype=np.float64).ravel()
+    if a.size == 0:
+        return math.nan, math.nan, math.nan, math.nan
+    if a.size < _SMALL_SAMPLE:
+        return _summary_loop(a.tolist())
+    return _summary(a)
+
+
+# Random generators for simulated measurements: each thread gets its own
+# independent stream spawned from one seed, so threads never share a lock
+_seed_seq = np.random.SeedSequence(42)
+_spawn_lock = threading.Lock()
+_thread_rngs = threading.local()
+
+
+def _get_rng():
+    """Random generator for the calling thread"""
+    rng = getattr(_thread_rngs, 'rng', None)
+    if rng is None:
+        with _spawn_lock:
+            child = _seed_seq.spawn(1)[0]
+        rng = _thread_rngs.rng = np.random.default_rng(child)
+    return rng
+
+
+def analyze_ph(samples=100, mean_ph=7.0, std_dev=0.5, rng=None, ax=None,
+               verbose=True, save_path=None, interactive=True):
     """
     Analyze pH levels in water samples
     
@@ -19,97 +156,240 @@ def analyze_ph(samples=100, mean_ph=7.0, std_dev=0.5):
         Expected mean pH (default: 7.0)
     std_dev : float
         Standard deviation (default: 0.5)
+    rng : numpy.random.Generator
+        Random generator used to simulate the samples (default: per-thread generator)
+    ax : matplotlib Axes
+        Existing axes to redraw the histogram on; a new figure is created
+        and shown when omitted (default: None)
+    verbose : bool
+        Print the summary report (default: True)
+    save_path : str
+        File to save the histogram to (default: None)
+    interactive : bool
+        Show the figure through pyplot (default: True). Set to False for
+        batch runs, tests and headless scripts: the histogram is rendered
+        off-screen with Agg if save_path is given, and otherwise not drawn
+        at all, without importing matplotlib
         
     Returns:
     --------
     ph_levels : array
         Array of pH measurements
     """
-    ph_levels = np.random.normal(mean_ph, std_dev, samples)
+    if rng is None:
+        rng = _get_rng()
+    ph_levels = rng.normal(mean_ph, std_dev, samples)
+    avg_ph, std_ph, min_ph, max_ph = _summary(ph_levels)
     
-    print("=" * 50)
-    print("pH ANALYSIS RESULTS")
-    print("=" * 50)
-    print(f"Number of samples: {samples}")
-    print(f"Average pH: {np.mean(ph_levels):.2f}")
-    print(f"Standard deviation: {np.std(ph_levels):.2f}")
-    print(f"pH Range: {np.min(ph_levels):.2f} - {np.max(ph_levels):.2f}")
+    if verbose:
+        # Determine water quality based on pH
+        if 6.5 <= avg_ph <= 8.5:
+            verdict = "✓ pH is within safe drinking water range (6.5-8.5)"
+        else:
+            verdict = "⚠ pH is outside safe drinking water range!"
+        safe_pct = ((ph_levels >= 6.5) & (ph_levels <= 8.5)).mean() * 100
+        print(_PH_REPORT % (samples, avg_ph, std_ph, min_ph, max_ph, safe_pct, verdict))
     
-    # Determine water quality based on pH
-    avg_ph = np.mean(ph_levels)
-    if 6.5 <= avg_ph <= 8.5:
-        print("✓ pH is within safe drinking water range (6.5-8.5)")
+    # Create visualization
+    owns_figure = ax is None
+    if not owns_figure:
+        ax.clear()
+    elif interactive:
+        import matplotlib.pyplot as plt
+
+        fig, ax = plt.subplots(figsize=(10, 6))
+    elif save_path is not None:
+        # Off-screen rendering without pyplot's global state or a GUI backend
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        fig = Figure(figsize=(10, 6))
+        FigureCanvasAgg(fig)
+        ax = fig.subplots()
     else:
-        print("⚠ pH is outside safe drinking water range!")
+        # Nothing would be shown or saved
+        return ph_levels
     
-    # Create visualization
-    plt.figure(figsize=(10, 6))
-    plt.hist(ph_levels, bins=20, edgecolor='black', alpha=0.7, color='skyblue')
-    plt.xlabel('pH Level', fontsize=12)
-    plt.ylabel('Frequency', fontsize=12)
-    plt.title('Distribution of Water pH Levels', fontsize=14, fontweight='bold')
-    plt.axvline(7.0, color='green', linestyle='--', linewidth=2, label='Neutral pH (7.0)')
-    plt.axvline(6.5, color='orange', linestyle='--', linewidth=1, label='Safe range limits')
-    plt.axvline(8.5, color='orange', linestyle='--', linewidth=1)
-    plt.legend()
-    plt.grid(True, alpha=0.3)
-    plt.tight_layout()
-    plt.show()
+    counts, edges = np.histogram(ph_levels, bins=20)
+    ax.stairs(counts, edges, fill=True, edgecolor='black', linewidth=1, alpha=0.7, color='skyblue')
+    ax.set_xlabel('pH Level', fontsize=12)
+    ax.set_ylabel('Frequency', fontsize=12)
+    ax.set_title('Distribution of Water pH Levels', fontsize=14, fontweight='bold')
+    ax.axvline(7.0, color='green', linestyle='--', linewidth=2, label='Neutral pH (7.0)')
+    ax.axvline(6.5, color='orange', linestyle='--', linewidth=1, label='Safe range limits')
+    ax.axvline(8.5, color='orange', linestyle='--', linewidth=1)
+    ax.legend()
+    ax.grid(True, alpha=0.3)
+    
+    if owns_figure:
+        fig.tight_layout()
+    if save_path is not None:
+        ax.figure.savefig(save_path)
+    if not owns_figure:
+        ax.figure.canvas.draw_idle()
+    elif interactive:
+        plt.show()
     
     return ph_levels
 
 
-def calculate_wqi(turbidity, dissolved_oxygen, temperature=20):
+def calculate_wqi(turbidity, dissolved_oxygen, temperature=20, verbose=True):
     """
     Calculate Water Quality Index
     
+    Works on single readings or on NumPy arrays of readings, in which case
+    the index and status are computed for every element at once.
+    
     Parameters:
     -----------
-    turbidity : float
+    turbidity : float or array
         Turbidity in NTU (0-10 scale, lower is better)
-    dissolved_oxygen : float
+    dissolved_oxygen : float or array
         Dissolved oxygen in mg/L (higher is better)
-    temperature : float
+    temperature : float or array
         Water temperature in Celsius (default: 20)
+    verbose : bool
+        Print a report for single readings (default: True)
         
     Returns:
     --------
-    wqi : float
+    wqi : float or array
         Water Quality Index (0-100)
-    status : str
+    status : str or array
         Quality classification
     """
     # Calculate WQI using weighted average
     # DO weight: 60%, Turbidity weight: 40%
-    wqi = (dissolved_oxygen * 0.6 + (10 - turbidity) * 0.4) * 10
+    wqi = _wqi(turbidity, dissolved_oxygen)
     
     # Determine status
-    if wqi > 80:
-        status = "Excellent"
-        emoji = "🌟"
-    elif wqi > 60:
-        status = "Good"
-        emoji = "✓"
-    elif wqi > 40:
-        status = "Fair"
-        emoji = "⚠"
-    else:
-        status = "Poor"
-        emoji = "✗"
-    
-    print("=" * 50)
-    print("WATER QUALITY INDEX")
-    print("=" * 50)
-    print(f"Turbidity: {turbidity:.1f} NTU")
-    print(f"Dissolved Oxygen: {dissolved_oxygen:.1f} mg/L")
-    print(f"Temperature: {temperature:.1f}°C")
-    print(f"\nWater Quality Index: {wqi:.1f}/100")
-    print(f"Status: {emoji} {status}")
-    print("=" * 50)
+    idx = _wqi_class(wqi)
+    if not np.isscalar(wqi):
+        return wqi, np.take(_STATUS, idx)
+    
+    status = _STATUS[int(idx)]
+    emoji = _EMOJI[int(idx)]
+    
+    if verbose:
+        print(_WQI_REPORT % (turbidity, dissolved_oxygen, temperature, wqi, emoji, status))
     
     return wqi, status
 
 
+def _make_wqi_batch_loop(prange):
+    """Build the batch scoring loop around numba's prange"""
+    def _wqi_batch_loop(turbidity, dissolved_oxygen, out_wqi, out_cls):
+        """Fill out_wqi with the index and out_cls with the class code (0-3)"""
+        for i in prange(turbidity.shape[0]):
+            wqi = (dissolved_oxygen[i] * 0.6 + (10.0 - turbidity[i]) * 0.4) * 10.0
+            out_wqi[i] = wqi
+            out_cls[i] = 3 if wqi > 80 else (2 if wqi > 60 else (1 if wqi > 40 else 0))
+
+    return _wqi_batch_loop
+
+
+def _wqi_batch_numpy(turbidity, dissolved_oxygen, out_wqi, out_cls):
+    """NumPy fallback for _wqi_batch when numba is not installed"""
+    out_wqi[:] = _wqi(turbidity, dissolved_oxygen)
+    out_cls[:] = _wqi_class(out_wqi)
+
+
+# Only contraction (fused multiply-add) and reciprocal approximations are
+# allowed: full fastmath assumes no NaNs, which would leave the class of a
+# missing reading undefined
+_WQI_FASTMATH = {'contract', 'arcp'}
+
+_wqi_batch = _lazy_kernel(
+    lambda numba: numba.njit(cache=True, fastmath=_WQI_FASTMATH)(
+        _make_wqi_batch_loop(numba.prange)),
+    _wqi_batch_numpy,
+)
+# Not cached: numba's cache key ignores parallel=True, so this build would
+# share (and overwrite) the serial kernel's cache entry
+_wqi_batch_parallel = _lazy_kernel(
+    lambda numba: numba.njit(parallel=True, fastmath=_WQI_FASTMATH)(
+        _make_wqi_batch_loop(numba.prange)),
+    _wqi_batch_numpy,
+)
+
+
+def calculate_wqi_batch(turbidity, dissolved_oxygen, parallel=False):
+    """
+    Calculate Water Quality Index for many readings at once
+    
+    Parameters:
+    -----------
+    turbidity : array-like
+        Turbidity readings in NTU
+    dissolved_oxygen : array-like
+        Dissolved oxygen readings in mg/L
+    parallel : bool
+        Spread the work across CPU cores (default: False)
+        
+    Returns:
+    --------
+    wqi : array
+        Water Quality Index (0-100) for each reading
+    status : array
+        Quality classification for each reading
+    """
+    turbidity, dissolved_oxygen = np.broadcast_arrays(
+        np.asarray(turbidity, dtype=np.float64),
+        np.asarray(dissolved_oxygen, dtype=np.float64),
+    )
+    shape = turbidity.shape
+    turbidity = np.ascontiguousarray(turbidity).ravel()
+    dissolved_oxygen = np.ascontiguousarray(dissolved_oxygen).ravel()
+    
+    wqi = np.empty(turbidity.size)
+    codes = np.empty(turbidity.size, dtype=np.int8)
+    kernel = _wqi_batch_parallel if parallel else _wqi_batch
+    kernel(turbidity, dissolved_oxygen, wqi, codes)
+    
+    status = np.take(_STATUS, codes)
+    return wqi.reshape(shape), status.reshape(shape)
+
+
+def _wqi_numpy(turbidity, dissolved_oxygen):
+    """NumPy fallback for _wqi_ufunc when numba is not installed"""
+    return _wqi(np.asarray(turbidity, dtype=np.float64),
+                np.asarray(dissolved_oxygen, dtype=np.float64))
+
+
+_wqi_ufunc = _lazy_kernel(
+    lambda numba: numba.vectorize(['float64(float64, float64)'], cache=True)(_wqi),
+    _wqi_numpy,
+)
+
+
+def calculate_wqi_array(turbidity, dissolved_oxygen):
+    """
+    Calculate Water Quality Index as a NumPy ufunc
+    
+    Broadcasts like any ufunc, e.g. one turbidity reading against many
+    dissolved oxygen readings. No status or report is produced.
+    
+    Parameters:
+    -----------
+    turbidity : float or array
+        Turbidity in NTU
+    dissolved_oxygen : float or array
+        Dissolved oxygen in mg/L
+        
+    Returns:
+    --------
+    wqi : float or array
+        Water Quality Index (0-100)
+    """
+    return _wqi_ufunc(turbidity, dissolved_oxygen)
+
+
+def _finite(values):
+    """Flat float array of the finite values; missing (NaN) readings are dropped"""
+    a = np.asarray(values, dtype=np.float64).ravel()
+    return a[np.isfinite(a)]
+
+
 def compare_samples(sample_a, sample_b, param_name="pH"):
     """
     Compare two sets of water samples
@@ -123,10 +403,8 @@ def compare_samples(sample_a, sample_b, param_name="pH"):
     param_name : str
         Name of parameter being measured
     """
-    mean_a = np.mean(sample_a)
-    mean_b = np.mean(sample_b)
-    std_a = np.std(sample_a)
-    std_b = np.std(sample_b)
+    mean_a, std_a, _, _ = _describe(sample_a)
+    mean_b, std_b, _, _ = _describe(sample_b)
     
     print(f"\nCOMPARISON: {param_name}")
     print("-" * 40)
@@ -135,19 +413,28 @@ def compare_samples(sample_a, sample_b, param_name="pH"):
     print(f"Difference: {abs(mean_a - mean_b):.2f}")
     
     # Visual comparison
+    import matplotlib.pyplot as plt
+    from matplotlib import cbook
+
     plt.figure(figsize=(12, 5))
     
     plt.subplot(1, 2, 1)
-    plt.hist(sample_a, bins=15, alpha=0.7, color='blue', label='Sample A', edgecolor='black')
-    plt.hist(sample_b, bins=15, alpha=0.7, color='red', label='Sample B', edgecolor='black')
+    # Same bin edges for both samples so the bars line up
+    finite_a = _finite(sample_a)
+    finite_b = _finite(sample_b)
+    edges = np.histogram_bin_edges(np.concatenate([finite_a, finite_b]), bins=15)
+    counts_a, _ = np.histogram(finite_a, bins=edges)
+    counts_b, _ = np.histogram(finite_b, bins=edges)
+    plt.stairs(counts_a, edges, fill=True, alpha=0.7, color='blue', label='Sample A', edgecolor='black', linewidth=1)
+    plt.stairs(counts_b, edges, fill=True, alpha=0.7, color='red', label='Sample B', edgecolor='black', linewidth=1)
     plt.xlabel(param_name)
     plt.ylabel('Frequency')
     plt.title('Distribution Comparison')
     plt.legend()
     plt.grid(True, alpha=0.3)
     
-    plt.subplot(1, 2, 2)
-    plt.boxplot([sample_a, sample_b], labels=['Sample A', 'Sample B'])
+    box_ax = plt.subplot(1, 2, 2)
+    box_ax.bxp(cbook.boxplot_stats([sample_a, sample_b], labels=['Sample A', 'Sample B']))
     plt.ylabel(param_name)
     plt.title('Box Plot Comparison')
     plt.grid(True, alpha=0.3)
@@ -156,6 +443,14 @@ def compare_samples(sample_a, sample_b, param_name="pH"):
     plt.show()
 
 
+# Daily measurements returned by generate_sample_data, one array per parameter
+SampleData = namedtuple('SampleData', ['ph', 'turbidity', 'dissolved_oxygen', 'temperature'])
+
+# Scale and offset per buffer row (pH, DO, temperature, turbidity)
+_SAMPLE_SCALE = np.array([[0.3], [1.5], [3.0], [6.0]])
+_SAMPLE_OFFSET = np.array([[7.2], [8.5], [18.0], [2.0]])
+
+
 def generate_sample_data(location="River", days=30):
     """
     Generate realistic sample water quality data
@@ -169,17 +464,22 @@ def generate_sample_data(location="River", days=30):
         
     Returns:
     --------
-    data : dict
-        Dictionary with pH, turbidity, and dissolved_oxygen arrays
+    data : SampleData
+        Named tuple with ph, turbidity, dissolved_oxygen and temperature
+        arrays (e.g. data.ph), all views into one (4, days) array
     """
-    np.random.seed(42)  # For reproducibility
+    rng = np.random.default_rng(42)  # For reproducibility
     
-    data = {
-        'ph': np.random.normal(7.2, 0.3, days),
-        'turbidity': np.random.uniform(2, 8, days),
-        'dissolved_oxygen': np.random.normal(8.5, 1.5, days),
-        'temperature': np.random.normal(18, 3, days)
-    }
+    # One buffer, one row per parameter, filled in place: standard normal
+    # draws for pH, DO and temperature, uniform [0, 1) for turbidity, then
+    # a single scale-and-shift to the real ranges
+    values = np.empty((4, days))
+    rng.standard_normal(out=values[:3])
+    rng.random(out=values[3])
+    values *= _SAMPLE_SCALE
+    values += _SAMPLE_OFFSET
+    data = SampleData(ph=values[0], turbidity=values[3],
+                      dissolved_oxygen=values[1], temperature=values[2])
     
     print(f"Generated {days} days of data for {location}")
     print(f"Parameters: pH, Turbidity, Dissolved Oxygen, Temperature")
@@ -193,18 +493,25 @@ def plot_time_series(data, title="Water Quality Over Time"):
     
     Parameters:
     -----------
-    data : dict
-        Dictionary with parameter arrays
+    data : SampleData
+        Parameter arrays from generate_sample_data
     title : str
         Plot title
     """
-    days = len(data['ph'])
+    import matplotlib.pyplot as plt
+
+    days = len(data.ph)
     time = np.arange(1, days + 1)
     
+    # Per-point markers dominate drawing time on long series, so past
+    # 50 days plot bare lines and rasterize them
+    dense = days > 50
+    markers = (None, None, None, None) if dense else ('o', 's', '^', 'd')
+    
     fig, axes = plt.subplots(2, 2, figsize=(14, 10))
     
     # pH
-    axes[0, 0].plot(time, data['ph'], marker='o', color='blue', linewidth=2)
+    axes[0, 0].plot(time, data.ph, marker=markers[0], color='blue', linewidth=2, rasterized=dense)
     axes[0, 0].axhline(7.0, color='green', linestyle='--', alpha=0.5, label='Neutral')
     axes[0, 0].set_xlabel('Day')
     axes[0, 0].set_ylabel('pH')
@@ -213,14 +520,14 @@ def plot_time_series(data, title="Water Quality Over Time"):
     axes[0, 0].legend()
     
     # Turbidity
-    axes[0, 1].plot(time, data['turbidity'], marker='s', color='brown', linewidth=2)
+    axes[0, 1].plot(time, data.turbidity, marker=markers[1], color='brown', linewidth=2, rasterized=dense)
     axes[0, 1].set_xlabel('Day')
     axes[0, 1].set_ylabel('Turbidity (NTU)')
     axes[0, 1].set_title('Turbidity')
     axes[0, 1].grid(True, alpha=0.3)
     
     # Dissolved Oxygen
-    axes[1, 0].plot(time, data['dissolved_oxygen'], marker='^', color='green', linewidth=2)
+    axes[1, 0].plot(time, data.dissolved_oxygen, marker=markers[2], color='green', linewidth=2, rasterized=dense)
     axes[1, 0].axhline(8.0, color='red', linestyle='--', alpha=0.5, label='Min. healthy')
     axes[1, 0].set_xlabel('Day')
     axes[1, 0].set_ylabel('Dissolved Oxygen (mg/L)')
@@ -229,7 +536,7 @@ def plot_time_series(data, title="Water Quality Over Time"):
     axes[1, 0].legend()
     
     # Temperature
-    axes[1, 1].plot(time, data['temperature'], marker='d', color='red', linewidth=2)
+    axes[1, 1].plot(time, data.temperature, marker=markers[3], color='red', linewidth=2, rasterized=dense)
     axes[1, 1].set_xlabel('Day')
     axes[1, 1].set_ylabel('Temperature (°C)')
     axes[1, 1].set_title('Water Temperature')